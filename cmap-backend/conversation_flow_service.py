@@ -3,8 +3,108 @@ from typing import Dict, List, Any, Optional, Set
 from dataclasses import dataclass, field
 from enum import Enum
 import json
+import logging
 import re
 from datetime import datetime
+from types import MappingProxyType
+
+from session_cache import SessionCache, MAX_SESSIONS, SESSION_TTL_SECONDS
+from unified_intelligent_service import _drop_redundant_patterns
+
+logger = logging.getLogger(__name__)
+
+# 会话重置模式（合并为单个正则，一次扫描）
+_SESSION_RESET_RE = re.compile(
+    r'new\s*(?:loan|application)'
+    r'|different\s*(?:loan|finance)'
+    r'|start\s*over'
+    r'|fresh\s*start'
+    r'|another\s*(?:loan|quote)'
+    r'|completely\s*different'
+)
+
+# 关键词分类：字段 -> ((取值, 关键词), ...)，同一字段内按优先级排列
+_KEYWORD_BUCKETS = (
+    ('loan_type', (
+        ('business', ('business loan', 'commercial loan', 'asset finance')),
+        ('consumer', ('personal loan', 'consumer loan'))
+    )),
+    ('asset_type', (
+        ('motor_vehicle', ('car', 'vehicle', 'truck', 'van', 'ute', 'motorcycle', 'auto')),
+        ('primary', ('primary equipment', 'main equipment', 'core machinery')),
+        ('secondary', ('secondary equipment', 'generator', 'compressor')),
+        ('tertiary', ('tertiary equipment', 'computer', 'IT equipment'))
+    )),
+    ('property_status', (
+        ('property_owner', ('own property', 'property owner', 'have property')),
+        ('non_property_owner', ("don't own property", "no property", 'rent'))
+    )),
+    ('vehicle_condition', (
+        ('new', ('new car', 'brand new', 'new vehicle')),
+        ('used', ('used car', 'second hand', 'pre-owned')),
+        ('demonstrator', ('demo', 'demonstrator'))
+    ))
+)
+# 关键词 -> (字段, 优先级, 取值)
+_KEYWORD_INDEX = {
+    keyword: (field_name, rank, value)
+    for field_name, options in _KEYWORD_BUCKETS
+    for rank, (value, keywords) in enumerate(options)
+    for keyword in keywords
+}
+# 前瞻匹配可找出重叠的关键词（如 "don't own property" 中的 "own property"），长关键词优先
+_KEYWORD_RE = re.compile("(?=(%s))" % "|".join(
+    map(re.escape, sorted(_KEYWORD_INDEX, key=len, reverse=True))
+))
+
+# 合法的业务结构取值
+_VALID_BIZ = frozenset({"sole_trader", "company", "partnership", "trust"})
+
+# 信息提取用正则（模块加载时编译一次）
+_ABN_RE = re.compile(r'abn.{0,20}(\d+).{0,10}year')
+_GST_RE = re.compile(r'gst.{0,20}(\d+).{0,10}year')
+_CREDIT_RE = re.compile(r'credit.{0,20}(\d{3,4})')
+# 贷款金额的几种写法合并为一个正则（命名分组），按 _AMOUNT_GROUPS 顺序决定优先级
+_AMOUNT_RE = re.compile(
+    r'[\$](?P<dollar>\d{1,3}(?:,\d{3})*(?:\.\d{2})?)'
+    r'|(?P<thousand>\d{1,3}(?:,\d{3})*)\s*(?:dollars?|k|thousand)'
+    r'|borrow\s*(?P<borrow>\d{1,3}(?:,\d{3})*)'
+    r'|loan\s*(?:of|for)?\s*[\$]?(?P<loan>\d{1,3}(?:,\d{3})*)'
+)
+_AMOUNT_GROUPS = ("dollar", "thousand", "borrow", "loan")
+# 贷款金额变更请求：几种写法合并为一个前瞻正则，一次扫描找出每个位置上匹配的写法
+# （各写法首字符互不相同，同一位置至多一种写法匹配），按 _AMOUNT_CHANGE_GROUPS 顺序决定优先级
+_AMOUNT_CHANGE_RE = re.compile(
+    r'(?=change.{0,20}amount.{0,20}to.{0,10}[\$]?(?P<change>\d{1,3}(?:,?\d{3})*)'
+    r'|loan.{0,20}amount.{0,20}[\$]?(?P<loan>\d{1,3}(?:,?\d{3})*)'
+    r'|(?P<instead>\d{1,3}(?:,?\d{3})*).{0,20}instead'
+    r'|update.{0,20}to.{0,10}[\$]?(?P<update>\d{1,3}(?:,?\d{3})*))'
+)
+_AMOUNT_CHANGE_GROUPS = ("change", "loan", "instead", "update")
+
+# 问题优先级（business_structure提前）
+_QUESTION_PRIORITY = (
+    ("loan_type", "What type of loan are you looking for? (business/consumer)"),
+    ("asset_type", "What type of asset are you looking to finance?"),
+    ("business_structure", "What is your business structure? (sole trader/company/partnership/trust)"),
+    ("property_status", "Do you own property?"),
+    ("ABN_years", "How many years has your ABN been registered?"),
+    ("GST_years", "How many years have you been registered for GST?"),
+    ("credit_score", "What is your current credit score?"),
+    ("desired_loan_amount", "How much would you like to borrow?")
+)
+# 车辆相关问题
+_VEHICLE_QUESTIONS = (
+    ("vehicle_type", "What type of vehicle? (passenger car/truck/van/motorcycle)"),
+    ("vehicle_condition", "Are you looking at new or used vehicles?"),
+    ("vehicle_make", "What make of vehicle?"),
+    ("vehicle_model", "What model of vehicle?")
+)
+# 车辆贷款：在credit_score之前插入车辆问题
+_CREDIT_QUESTION_INDEX = next(i for i, (name, _) in enumerate(_QUESTION_PRIORITY) if name == "credit_score")
+_QUESTION_PRIORITY_WITH_VEHICLE = (
+    _QUESTION_PRIORITY[:_CREDIT_QUESTION_INDEX] + _VEHICLE_QUESTIONS + _QUESTION_PRIORITY[_CREDIT_QUESTION_INDEX:]
+)
 
 class ConversationStage(Enum):
     GREETING = "greeting"
@@ -16,7 +116,7 @@ class ConversationStage(Enum):
     FINAL_RECOMMENDATION = "final_recommendation"
     HANDOFF = "handoff"
 
-@dataclass
+@dataclass(slots=True)
 class CustomerInformation:
     """Customer information storage with memory tracking"""
     # Basic MVP fields
@@ -87,7 +187,7 @@ class CustomerInformation:
         important_fields = ["credit_score", "desired_loan_amount"]
         return [field for field in important_fields if not self.is_field_complete(field)]
 
-@dataclass 
+@dataclass(slots=True)
 class ConversationMemory:
     """Conversation memory management"""
     session_id: str
@@ -120,34 +220,41 @@ class ConversationMemory:
 class EnhancedMemoryService:
     """Enhanced memory service with anti-repetition and context awareness"""
     
+    # 🔧 修复：增强的业务结构提取模式（类级只读常量，所有实例共享）
+    business_structure_patterns = MappingProxyType({
+        'sole_trader': (
+            r'sole\s*trader', r'individual\s*trader', r'self\s*employed',
+            r'operating\s*as\s*an\s*individual', r'trading\s*individually'
+        ),
+        'company': (
+            r'company', r'pty\s*ltd', r'corporation', r'incorporated',
+            r'\bltd\b', r'corporate\s*entity', r'limited\s*company'
+        ),
+        'partnership': (
+            r'partnership', r'partners', r'joint\s*venture',
+            r'business\s*partnership', r'trading\s*partnership'
+        ),
+        'trust': (
+            r'trust', r'family\s*trust', r'discretionary\s*trust',
+            r'unit\s*trust', r'trustee', r'trading\s*trust'
+        )
+    })
+    # 每类业务结构的模式合并为一个正则，按类别顺序逐个匹配（保持原优先级），已被同组短词覆盖的模式不再参与匹配
+    _business_structure_regexes = tuple(
+        (structure, re.compile("|".join(f"(?:{p})" for p in _drop_redundant_patterns(patterns)), re.IGNORECASE))
+        for structure, patterns in business_structure_patterns.items()
+    )
+    
     def __init__(self):
-        self.sessions: Dict[str, ConversationMemory] = {}
-        
-        # 🔧 修复：增强的业务结构提取模式
-        self.business_structure_patterns = {
-            'sole_trader': [
-                r'sole\s*trader', r'individual\s*trader', r'self\s*employed',
-                r'operating\s*as\s*an\s*individual', r'trading\s*individually'
-            ],
-            'company': [
-                r'company', r'pty\s*ltd', r'corporation', r'incorporated',
-                r'\bltd\b', r'corporate\s*entity', r'limited\s*company'
-            ],
-            'partnership': [
-                r'partnership', r'partners', r'joint\s*venture',
-                r'business\s*partnership', r'trading\s*partnership'
-            ],
-            'trust': [
-                r'trust', r'family\s*trust', r'discretionary\s*trust',
-                r'unit\s*trust', r'trustee', r'trading\s*trust'
-            ]
-        }
+        # 有容量上限和空闲过期的会话缓存，避免会话无限增长
+        self.sessions = SessionCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
     
     def get_or_create_session(self, session_id: str) -> ConversationMemory:
         """Get existing session or create new one"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ConversationMemory(session_id=session_id)
-        return self.sessions[session_id]
+        memory = self.sessions.get(session_id)
+        if memory is None:
+            memory = self.sessions[session_id] = ConversationMemory(session_id=session_id)
+        return memory
     
     def update_customer_information(self, session_id: str, extracted_info: Dict[str, Any]):
         """🔧 修复：更新客户信息，包含业务结构处理"""
@@ -157,11 +264,11 @@ class EnhancedMemoryService:
             if hasattr(memory.customer_info, field) and value is not None:
                 # 验证业务结构值
                 if field == 'business_structure':
-                    if value in ['sole_trader', 'company', 'partnership', 'trust']:
+                    if value in _VALID_BIZ:
                         memory.customer_info.update_field(field, value)
-                        print(f"🏢 Updated business structure: {value}")
+                        logger.debug("🏢 Updated business structure: %s", value)
                     else:
-                        print(f"⚠️ Invalid business structure value: {value}")
+                        logger.warning("⚠️ Invalid business structure value: %s", value)
                 else:
                     memory.customer_info.update_field(field, value)
     
@@ -171,89 +278,52 @@ class EnhancedMemoryService:
         message_lower = user_message.lower()
         
         # 🔧 修复：业务结构提取
-        for structure, patterns in self.business_structure_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, message_lower, re.IGNORECASE):
-                    extracted['business_structure'] = structure
-                    print(f"🏢 Extracted business structure: {structure}")
-                    break
-            if 'business_structure' in extracted:
+        for structure, structure_re in self._business_structure_regexes:
+            if structure_re.search(message_lower):
+                extracted['business_structure'] = structure
+                logger.debug("🏢 Extracted business structure: %s", structure)
                 break
         
-        # 贷款类型提取
-        if any(phrase in message_lower for phrase in ['business loan', 'commercial loan', 'asset finance']):
-            extracted['loan_type'] = 'business'
-        elif any(phrase in message_lower for phrase in ['personal loan', 'consumer loan']):
-            extracted['loan_type'] = 'consumer'
-        
-        # 资产类型提取
-        asset_keywords = {
-            'motor_vehicle': ['car', 'vehicle', 'truck', 'van', 'ute', 'motorcycle', 'auto'],
-            'primary': ['primary equipment', 'main equipment', 'core machinery'],
-            'secondary': ['secondary equipment', 'generator', 'compressor'],
-            'tertiary': ['tertiary equipment', 'computer', 'IT equipment']
-        }
+        # 贷款类型 / 资产类型 / 房产状态 / 车辆状况：一次扫描所有关键词
+        best_matches = {}
+        for match in _KEYWORD_RE.finditer(message_lower):
+            field_name, rank, value = _KEYWORD_INDEX[match.group(1)]
+            if field_name not in best_matches or rank < best_matches[field_name][0]:
+                best_matches[field_name] = (rank, value)
         
-        for asset_type, keywords in asset_keywords.items():
-            if any(keyword in message_lower for keyword in keywords):
-                extracted['asset_type'] = asset_type
-                break
-        
-        # 房产状态提取
-        if any(phrase in message_lower for phrase in ['own property', 'property owner', 'have property']):
-            extracted['property_status'] = 'property_owner'
-        elif any(phrase in message_lower for phrase in ["don't own property", "no property", 'rent']):
-            extracted['property_status'] = 'non_property_owner'
-        
-        # 车辆状况提取
-        if any(phrase in message_lower for phrase in ['new car', 'brand new', 'new vehicle']):
-            extracted['vehicle_condition'] = 'new'
-        elif any(phrase in message_lower for phrase in ['used car', 'second hand', 'pre-owned']):
-            extracted['vehicle_condition'] = 'used'
-        elif any(phrase in message_lower for phrase in ['demo', 'demonstrator']):
-            extracted['vehicle_condition'] = 'demonstrator'
+        for field_name, _ in _KEYWORD_BUCKETS:
+            if field_name in best_matches:
+                extracted[field_name] = best_matches[field_name][1]
         
         # 数值提取
         # ABN年限
-        abn_match = re.search(r'abn.{0,20}(\d+).{0,10}year', message_lower)
+        abn_match = _ABN_RE.search(message_lower)
         if abn_match:
             extracted['ABN_years'] = int(abn_match.group(1))
         
         # GST年限
-        gst_match = re.search(r'gst.{0,20}(\d+).{0,10}year', message_lower)
+        gst_match = _GST_RE.search(message_lower)
         if gst_match:
             extracted['GST_years'] = int(gst_match.group(1))
         
         # 信用分数
-        credit_match = re.search(r'credit.{0,20}(\d{3,4})', message_lower)
+        credit_match = _CREDIT_RE.search(message_lower)
         if credit_match:
             score = int(credit_match.group(1))
             if 300 <= score <= 900:
                 extracted['credit_score'] = score
         
         # 🔧 修复：增强的贷款金额提取
-        amount_patterns = [
-            r'[\$](\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-            r'(\d{1,3}(?:,\d{3})*)\s*(?:dollars?|k|thousand)',
-            r'borrow\s*(\d{1,3}(?:,\d{3})*)',
-            r'loan\s*(?:of|for)?\s*[\$]?(\d{1,3}(?:,\d{3})*)'
-        ]
-        
-        for pattern in amount_patterns:
-            matches = re.findall(pattern, user_message.replace(',', ''))
-            if matches:
-                amounts = []
-                for match in matches:
-                    try:
-                        amount = float(match.replace(',', ''))
-                        if amount > 1000:  # 过滤小数字
-                            amounts.append(amount)
-                    except ValueError:
-                        continue
-                
-                if amounts:
-                    extracted['desired_loan_amount'] = max(amounts)
-                    break
+        # 一次扫描收集各写法的金额，再按优先级取第一种有效写法中的最大值
+        amounts_by_group = {}
+        for match in _AMOUNT_RE.finditer(user_message.replace(',', '')):
+            amount = float(match.group(match.lastgroup))
+            if amount > 1000:  # 过滤小数字
+                amounts_by_group.setdefault(match.lastgroup, []).append(amount)
+        for group in _AMOUNT_GROUPS:
+            if group in amounts_by_group:
+                extracted['desired_loan_amount'] = max(amounts_by_group[group])
+                break
         
         # 更新内存中的客户信息
         if extracted:
@@ -265,30 +335,11 @@ class EnhancedMemoryService:
         """🔧 修复：获取下一个要问的问题，优先business_structure"""
         memory = self.get_or_create_session(session_id)
         
-        # 定义问题优先级，business_structure提前
-        question_priority = [
-            ("loan_type", "What type of loan are you looking for? (business/consumer)"),
-            ("asset_type", "What type of asset are you looking to finance?"),
-            ("business_structure", "What is your business structure? (sole trader/company/partnership/trust)"),
-            ("property_status", "Do you own property?"),
-            ("ABN_years", "How many years has your ABN been registered?"),
-            ("GST_years", "How many years have you been registered for GST?"),
-            ("credit_score", "What is your current credit score?"),
-            ("desired_loan_amount", "How much would you like to borrow?")
-        ]
-        
-        # 添加车辆相关问题（如果适用）
+        # 车辆贷款使用插入了车辆问题的优先级表
         if memory.customer_info.asset_type == 'motor_vehicle':
-            vehicle_questions = [
-                ("vehicle_type", "What type of vehicle? (passenger car/truck/van/motorcycle)"),
-                ("vehicle_condition", "Are you looking at new or used vehicles?"),
-                ("vehicle_make", "What make of vehicle?"),
-                ("vehicle_model", "What model of vehicle?")
-            ]
-            # 在credit_score之前插入车辆问题
-            insert_index = next(i for i, (field, _) in enumerate(question_priority) if field == "credit_score")
-            for i, (field, question) in enumerate(vehicle_questions):
-                question_priority.insert(insert_index + i, (field, question))
+            question_priority = _QUESTION_PRIORITY_WITH_VEHICLE
+        else:
+            question_priority = _QUESTION_PRIORITY
         
         next_questions = []
         
@@ -309,51 +360,33 @@ class EnhancedMemoryService:
     
     def should_reset_session(self, session_id: str, user_message: str) -> bool:
         """🔧 修复2：检测是否应该重置会话"""
-        reset_patterns = [
-            r'new\s*(loan|application)',
-            r'different\s*(loan|finance)', 
-            r'start\s*over',
-            r'fresh\s*start',
-            r'another\s*(loan|quote)',
-            r'completely\s*different'
-        ]
-        
-        message_lower = user_message.lower()
-        
-        for pattern in reset_patterns:
-            if re.search(pattern, message_lower):
-                print(f"🔄 Session reset detected: {pattern}")
-                return True
+        match = _SESSION_RESET_RE.search(user_message.lower())
+        if match:
+            logger.debug("🔄 Session reset detected: %s", match.group(0))
+            return True
         
         return False
     
     def reset_session(self, session_id: str):
         """🔧 修复2：重置会话状态"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            print(f"🔄 Session {session_id} has been reset")
+        if self.sessions.pop(session_id) is not None:
+            logger.info("🔄 Session %s has been reset", session_id)
     
     def detect_loan_amount_change(self, session_id: str, user_message: str) -> Optional[float]:
         """🔧 修复3：检测贷款金额变更请求"""
-        change_patterns = [
-            r'change.{0,20}amount.{0,20}to.{0,10}[\$]?(\d{1,3}(?:,?\d{3})*)',
-            r'loan.{0,20}amount.{0,20}[\$]?(\d{1,3}(?:,?\d{3})*)',
-            r'(\d{1,3}(?:,?\d{3})*).{0,20}instead',
-            r'update.{0,20}to.{0,10}[\$]?(\d{1,3}(?:,?\d{3})*)'
-        ]
-        
         message_lower = user_message.lower().replace(',', '')
         
-        for pattern in change_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                try:
-                    new_amount = float(match.group(1).replace(',', ''))
-                    if new_amount > 10000:  # 确保是合理的金额
-                        print(f"💰 Detected loan amount change request: ${new_amount:,}")
-                        return new_amount
-                except (ValueError, IndexError):
-                    continue
+        # 每种写法只取最靠前的匹配
+        first_amounts = {}
+        for match in _AMOUNT_CHANGE_RE.finditer(message_lower):
+            first_amounts.setdefault(match.lastgroup, match.group(match.lastgroup))
+        
+        for group in _AMOUNT_CHANGE_GROUPS:
+            if group in first_amounts:
+                new_amount = float(first_amounts[group].replace(',', ''))
+                if new_amount > 10000:  # 确保是合理的金额
+                    logger.debug("💰 Detected loan amount change request: $%s", f"{new_amount:,}")
+                    return new_amount
         
         return None
     
@@ -492,9 +525,8 @@ Important Fields: {memory.customer_info.get_missing_important_fields()}
     
     def clear_session(self, session_id: str):
         """Clear session memory"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            print(f"🗑️ Cleared session: {session_id}")
+        if self.sessions.pop(session_id) is not None:
+            logger.info("🗑️ Cleared session: %s", session_id)
 
 # 保持向后兼容性的别名
 ConversationFlowService = EnhancedMemoryService
\ No newline at end of file
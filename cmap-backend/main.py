@@ -1,15 +1,17 @@
 # main.py - 修复版本：恢复unified_intelligent_service集成
 import os
 import json
+import logging
 import time
 import asyncio
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
-import httpx
 import threading
 
+from session_cache import SessionCache, MAX_SESSIONS, SESSION_TTL_SECONDS
+
 # 🔧 关键修复：恢复unified_intelligent_service导入
 try:
     from unified_intelligent_service import UnifiedIntelligentService
@@ -19,11 +21,24 @@ except ImportError as e:
     print(f"⚠️ Failed to load unified service: {e}")
     UNIFIED_SERVICE_AVAILABLE = False
 
+# 可选：orjson 序列化更快，未安装时回退到标准库 json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # 加载环境变量
 load_dotenv()
 
-# 全局变量
-conversation_memory = {}
+# 日志级别可通过 LOG_LEVEL 配置（如 DEBUG 可查看对话处理细节）
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+# 全局变量：会话记忆有容量上限并按空闲时间过期（线程安全，替代定期清理）
+conversation_memory = SessionCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
 unified_service = None
 
 # 🔧 修复：初始化unified service
@@ -35,6 +50,15 @@ if UNIFIED_SERVICE_AVAILABLE:
         print(f"❌ Failed to initialize unified service: {e}")
         UNIFIED_SERVICE_AVAILABLE = False
 
+def _dumps_json(data) -> bytes:
+    """序列化响应为UTF-8 JSON字节，orjson不支持的类型回退到json"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
 # API配置
 ANTHROPIC_API_KEY = (
     os.getenv("ANTHROPIC_API_KEY") or 
@@ -62,33 +86,22 @@ print(f"🤖 Model: {MODEL_NAME}")
 print(f"🧠 Unified Service: {'✅ Active' if UNIFIED_SERVICE_AVAILABLE else '❌ Disabled'}")
 print(f"📁 Product Database: {'docs/' if UNIFIED_SERVICE_AVAILABLE else 'Not available'}")
 
-def cleanup_old_sessions():
-    """清理超过1小时的旧会话"""
-    current_time = time.time()
-    expired_sessions = []
-    
-    for session_id, session_data in conversation_memory.items():
-        if current_time - session_data.get("created_at", 0) > 3600:
-            expired_sessions.append(session_id)
-    
-    for session_id in expired_sessions:
-        del conversation_memory[session_id]
-        print(f"🗑️ Cleaned up expired session: {session_id}")
-
 def get_session_or_create(session_id):
     """获取或创建会话"""
-    if session_id not in conversation_memory:
-        conversation_memory[session_id] = {
+    now = time.time()
+    session_data = conversation_memory.get(session_id)
+    if session_data is None:
+        session_data = conversation_memory[session_id] = {
             "messages": [],
             "customer_info": {},
-            "created_at": time.time(),
-            "last_active": time.time()
+            "created_at": now,
+            "last_active": now
         }
         print(f"📝 Created new session: {session_id}")
     else:
-        conversation_memory[session_id]["last_active"] = time.time()
+        session_data["last_active"] = now
     
-    return conversation_memory[session_id]
+    return session_data
 
 async def process_with_unified_service(message, session_id, customer_info):
     """🔧 修复：使用统一智能服务处理消息 - 保持原有功能完整"""
@@ -122,12 +135,13 @@ async def process_with_unified_service(message, session_id, customer_info):
             
             # 🔧 确保推荐数据包含前端product comparison需要的完整信息
             if standardized_response["recommendations"]:
+                now = time.time()
                 for rec in standardized_response["recommendations"]:
                     # 确保每个推荐包含必要字段
                     if "timestamp" not in rec:
-                        rec["timestamp"] = time.time()
+                        rec["timestamp"] = now
                     if "id" not in rec:
-                        rec["id"] = f"{rec.get('lender_name', 'unknown')}_{rec.get('product_name', 'product')}_{int(time.time())}"
+                        rec["id"] = f"{rec.get('lender_name', 'unknown')}_{rec.get('product_name', 'product')}_{int(now)}"
             
             return standardized_response
         else:
@@ -166,6 +180,7 @@ Guidelines:
         if context_items:
             system_prompt += f"\n\nCustomer context: {', '.join(context_items)}"
     
+    import httpx  # 延迟导入：只有降级调用AI时才加载httpx
     try:
         async with httpx.AsyncClient(timeout=60.0) as client:
             if API_TYPE == "anthropic":
@@ -286,8 +301,7 @@ class CORSRequestHandler(BaseHTTPRequestHandler):
         self._set_cors_headers()
         self.end_headers()
         
-        response_json = json.dumps(data, ensure_ascii=False)
-        self.wfile.write(response_json.encode('utf-8'))
+        self.wfile.write(_dumps_json(data))
     
     def _send_error_response(self, status_code, message):
         """发送错误响应"""
@@ -376,7 +390,8 @@ class CORSRequestHandler(BaseHTTPRequestHandler):
                 "product_database_status": "loaded" if UNIFIED_SERVICE_AVAILABLE else "unavailable",
                 "lenders_available": ["Angle", "BFS", "FCAU", "RAF"] if UNIFIED_SERVICE_AVAILABLE else [],
                 "cors_enabled": True,
-                "active_sessions": len(conversation_memory)
+                "active_sessions": len(conversation_memory),
+                "session_cache": unified_service.conversation_states.stats() if unified_service else None
             }
         }
         self._send_json_response(200, response)
@@ -441,10 +456,6 @@ class CORSRequestHandler(BaseHTTPRequestHandler):
                 "timestamp": time.time()
             })
             
-            # 定期清理旧会话
-            if len(conversation_memory) > 50:
-                cleanup_old_sessions()
-            
             # 🔧 核心：使用unified service处理消息
             import concurrent.futures
             
@@ -526,8 +537,8 @@ class CORSRequestHandler(BaseHTTPRequestHandler):
     
     def _handle_session_status(self, session_id):
         """处理会话状态查询"""
-        if session_id in conversation_memory:
-            session_data = conversation_memory[session_id]
+        session_data = conversation_memory.get(session_id)
+        if session_data is not None:
             response = {
                 "status": "active",
                 "message_count": len(session_data["messages"]),
@@ -544,8 +555,7 @@ class CORSRequestHandler(BaseHTTPRequestHandler):
         """处理会话重置"""
         session_id = data.get("session_id")
         
-        if session_id and session_id in conversation_memory:
-            del conversation_memory[session_id]
+        if session_id and conversation_memory.pop(session_id) is not None:
             print(f"🔄 Session reset: {session_id}")
             response = {"status": "reset", "session_id": session_id}
         else:
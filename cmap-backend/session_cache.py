@@ -0,0 +1,203 @@
+# session_cache.py - 会话状态缓存：LRU容量上限 + 空闲过期(TTL)，可选 Redis 共享存储
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+# 可选：配置 REDIS_URL 且安装了 redis 时，会话存入 Redis，多个实例共享、重启不丢失
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+_MISSING = object()
+
+class SessionCache:
+    """线程安全的会话缓存
+
+    - 超过 maxsize 时淘汰最久未访问的会话（LRU）
+    - 会话空闲超过 ttl 秒后过期，每次访问都会刷新过期时间
+    - 提供命中率 / 淘汰数等统计，供健康检查使用
+    """
+
+    def __init__(self, maxsize: int = MAX_SESSIONS, ttl: float = SESSION_TTL_SECONDS, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [expires_at, value]
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _purge_expired(self, now: float):
+        """按访问顺序排列，过期的会话一定在最前面"""
+        data = self._data
+        while data:
+            key, entry = next(iter(data.items()))
+            if entry[0] > now:
+                break
+            del data[key]
+            self.expirations += 1
+
+    def _lookup(self, key: Hashable):
+        """查找并刷新会话，不存在或已过期返回 _MISSING"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        now = self._timer()
+        if entry[0] <= now:
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+        entry[0] = now + self.ttl
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            now = self._timer()
+            self._purge_expired(now)
+            self._data[key] = [now + self.ttl, value]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            del self._data[key]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge_expired(self._timer())
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+class RedisSessionStore:
+    """Redis 会话存储，接口与 SessionCache 一致
+
+    - 值用 pickle 序列化（Redis 只应对本服务可信，不要与不受信任的客户端共用）
+    - 每次读写都刷新过期时间（空闲过期），容量由 Redis 的 maxmemory 策略控制
+    - 读到的是副本：修改会话后需要重新赋值写回
+    """
+
+    def __init__(self, url: str, ttl: float = SESSION_TTL_SECONDS, prefix: str = "cmap:session:"):
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.prefix}{key}"
+
+    def _load(self, key: Hashable):
+        """读取并刷新过期时间（一次往返），不存在返回 _MISSING"""
+        pipe = self._redis.pipeline()
+        pipe.get(self._key(key))
+        pipe.expire(self._key(key), self.ttl)
+        raw, _ = pipe.execute()
+        if raw is None:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return bool(self._redis.exists(self._key(key)))
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._load(key)
+        return default if value is _MISSING else value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._redis.set(self._key(key), pickle.dumps(value), ex=self.ttl)
+
+    def __delitem__(self, key: Hashable):
+        if not self._redis.delete(self._key(key)):
+            raise KeyError(key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        pipe = self._redis.pipeline()
+        pipe.get(self._key(key))
+        pipe.delete(self._key(key))
+        raw, _ = pipe.execute()
+        return default if raw is None else pickle.loads(raw)
+
+    def stats(self) -> Dict[str, Any]:
+        """存储统计信息（会话数量由 Redis 管理，不逐个统计）"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+def make_session_store(maxsize: int = MAX_SESSIONS, ttl: float = SESSION_TTL_SECONDS):
+    """配置了 REDIS_URL 且 redis 可用时返回 Redis 存储，否则返回进程内 SessionCache"""
+    if REDIS_URL:
+        if REDIS_AVAILABLE:
+            print(f"🗄️ Session store: Redis ({REDIS_URL.rsplit('@', 1)[-1]})")
+            return RedisSessionStore(REDIS_URL, ttl=ttl)
+        print("⚠️ REDIS_URL is set but the redis package is not installed, using in-memory sessions")
+    return SessionCache(maxsize=maxsize, ttl=ttl)